@@ -1,12 +1,28 @@
 import requests
 import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import ConnectTimeout
-import argparse
+from urllib3.util.retry import Retry
+
+if TYPE_CHECKING:
+    import argparse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 BASE_WORKITEM_URL = "https://dev.azure.com/#PROJECT_PATH#/_apis/wit/workItems/"
+BASE_WORKITEMSBATCH_URL = (
+    "https://dev.azure.com/#PROJECT_PATH#/_apis/wit/workitemsbatch"
+)
 BASE_QUERY_URL = "https://dev.azure.com/#PROJECT_PATH#/_apis/wit/wiql"
+BASE_BATCH_URL = "https://dev.azure.com/#PROJECT_PATH#/_apis/wit/$batch"
 
 WORKITEM_API_VERSION = "7.1-preview"
 QUERY_API_VERSION = "7.1-preview"
@@ -14,6 +30,31 @@ QUERY_API_VERSION = "7.1-preview"
 GIT_PATH_MIN_LENGTH = 10
 TASKITEM_QUERY_LIMIT = 1
 
+WORKITEM_BATCH_LIMIT = 200
+# WIQL responses that can hold at least this many TaskItems are parsed as a stream if ijson is installed
+QUERY_STREAMING_MIN_ITEMS = 1000
+# separates the existing field value from the appended one for "add" operation
+ADD_OPERATION_SEPARATOR = "<br>==========<br>"
+
+HTTP_POOL_MAXSIZE = 16
+HTTP_RETRY_TOTAL = 5
+HTTP_RETRY_BACKOFF_FACTOR = 0.5
+HTTP_RETRY_STATUS_FORCELIST = (429, 500, 502, 503, 504)
+# PATCH payloads always carry the complete new field value, so repeating any of these requests is safe
+HTTP_RETRY_ALLOWED_METHODS = frozenset(["GET", "POST", "PATCH"])
+
+
+# orjson is used for (de)serialization if it is installed, the standard json module otherwise
+if orjson is not None:
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+else:
+
+    def _json_dumps(obj) -> bytes:
+        return json.dumps(obj).encode()
+
+    _json_loads = json.loads
+
 
 class DevAzureReporter:
     def __init__(
@@ -28,38 +69,131 @@ class DevAzureReporter:
         self.workitem_url = BASE_WORKITEM_URL.replace(
             "#PROJECT_PATH#", self.dev_azure_org_project
         )
+        self.workitemsbatch_url = BASE_WORKITEMSBATCH_URL.replace(
+            "#PROJECT_PATH#", self.dev_azure_org_project
+        )
         self.query_url = BASE_QUERY_URL.replace(
             "#PROJECT_PATH#", self.dev_azure_org_project
         )
+        self.batch_url = BASE_BATCH_URL.replace(
+            "#PROJECT_PATH#", self.dev_azure_org_project
+        )
         self.taskitem_query_limit = taskitem_query_limit
+        self._field_cache = {}
+
+        # api-version query strings are constant, so they are appended to urls directly instead of using params
+        self._workitem_qs = f"?api-version={WORKITEM_API_VERSION}"
+        self._query_qs = f"?api-version={QUERY_API_VERSION}"
+
+        # a single session keeps the connection to dev.azure.com alive between calls;
+        # throttled (429) and failed (5xx) requests are retried with exponential backoff,
+        # honoring Retry-After, so only a final failure reaches the error handling of the callers
+        self._session = requests.Session()
+        self._session.auth = HTTPBasicAuth("", self.token)
+        self._session.headers.update(
+            {"Accept": "application/json", "Accept-Encoding": "gzip, deflate"}
+        )
+        self._session.mount(
+            "https://",
+            HTTPAdapter(
+                pool_connections=1,
+                pool_maxsize=HTTP_POOL_MAXSIZE,
+                max_retries=Retry(
+                    total=HTTP_RETRY_TOTAL,
+                    backoff_factor=HTTP_RETRY_BACKOFF_FACTOR,
+                    status_forcelist=HTTP_RETRY_STATUS_FORCELIST,
+                    allowed_methods=HTTP_RETRY_ALLOWED_METHODS,
+                    respect_retry_after_header=True,
+                ),
+            ),
+        )
+
+    def __enter__(self) -> "DevAzureReporter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        This function closes the HTTP session and releases pooled connections.
+        """
+        self._session.close()
 
     def _read_value(self, task_id: int, field_name: str) -> dict:
         """
         This function reads an existing value from the TaskItem.
         Accepts task_id (dev.azure.com TaskItem id) and field_name.
+        Values are cached per instance; when report updates the field, the written value is cached.
         Returns a value of a field if the field exists or an empty string otherwise.
         """
 
+        if (task_id, field_name) in self._field_cache:
+            return self._field_cache[(task_id, field_name)]
+
         url = f"{self.workitem_url}{task_id}"
         try:
-            rslt = requests.get(
-                url,
-                headers={"Accept": "application/json"},
-                auth=HTTPBasicAuth("", self.token),
-                params={"api-version": WORKITEM_API_VERSION},
+            rslt = self._session.get(
+                f"{url}{self._workitem_qs}",
                 timeout=10,
             )
             rslt.raise_for_status()
-            return rslt.json()["fields"][field_name]
+            field_value = _json_loads(rslt.content)["fields"][field_name]
         except ConnectTimeout as e:
             print(f"Connection timeout for {url}")
             exit(1)
         except KeyError as e:
-            return ""
+            field_value = ""
         except Exception as e:
             print(e)
             exit(1)
 
+        self._field_cache[(task_id, field_name)] = field_value
+        return field_value
+
+    def _read_values(self, task_ids: list, field_name: str) -> dict:
+        """
+        This function reads existing values of a field from several TaskItems with a single request.
+        Accepts task_ids (dev.azure.com TaskItem ids, up to WORKITEM_BATCH_LIMIT) and field_name.
+        Returns a dict of task_id -> field value (an empty string if the field does not exist).
+        """
+
+        try:
+            rslt = self._session.post(
+                f"{self.workitemsbatch_url}{self._workitem_qs}",
+                headers={"Content-Type": "application/json"},
+                data=_json_dumps({"ids": task_ids, "fields": [field_name]}),
+                timeout=10,
+            )
+            rslt.raise_for_status()
+            return {
+                item["id"]: item.get("fields", {}).get(field_name, "")
+                for item in _json_loads(rslt.content)["value"]
+            }
+        except ConnectTimeout as e:
+            print(f"Connection timeout for {self.workitemsbatch_url}")
+            exit(1)
+        except Exception as e:
+            print(e)
+            exit(1)
+
+    def _update_is_redundant(self, old_value: str, value: str, operation: str) -> bool:
+        """
+        This function checks if an update would leave the field as it is, e.g. when the reporter
+        is re-run after a retry: "add" of a value the field already ends with, or "replace" with
+        the same value. It cannot tell such a re-run from a new report of the same value,
+        so it is only used with skip_unchanged. old_value is None when the current field value is unknown.
+        Returns True if the update can be skipped or False otherwise.
+        """
+        if old_value is None:
+            return False
+        if operation == "add":
+            return old_value.endswith(f"{ADD_OPERATION_SEPARATOR}{value}")
+        if operation == "replace":
+            return old_value == value
+
+        return False
+
     def _git_path_is_valid(self, git_path):
         """
         This function checks if git_path conforms to the following restrictions:
@@ -86,7 +220,7 @@ class DevAzureReporter:
     def _find_tasks(self, query_field: str, git_path: str) -> list:
         """
         This function performs a search for TaskItems that contain git_path in their metadata field specified in query_field.
-        Returns a list of matching TaskItems ids
+        Returns a sorted list of unique matching TaskItems ids
         """
         if not self._git_path_is_valid(git_path):
             print(
@@ -101,18 +235,18 @@ class DevAzureReporter:
             "query": f"Select [System.Id] From WorkItems Where [{query_field}] Contains '{git_path}'"
         }
         try:
-            rslt = requests.post(
-                self.query_url,
-                headers={
-                    "Accept": "application/json",
-                    "Content-Type": "application/json",
-                },
-                auth=HTTPBasicAuth("", self.token),
-                params={"api-version": QUERY_API_VERSION},
-                data=json.dumps(search_data),
+            # one more than the limit is requested, so that exceeding the limit can still be detected;
+            # $top is built here, since taskitem_query_limit can be changed after __init__
+            rslt = self._session.post(
+                f"{self.query_url}{self._query_qs}&$top={self.taskitem_query_limit + 1}",
+                headers={"Content-Type": "application/json"},
+                data=_json_dumps(search_data),
                 timeout=10,
+                stream=True,
             )
             rslt.raise_for_status()
+            # with stream=True the body is downloaded here, so its errors are handled below as well
+            task_ids = self._read_task_ids(rslt)
         except ConnectTimeout as e:
             print(f"Connection timeout for {self.query_url}")
             exit(1)
@@ -121,15 +255,18 @@ class DevAzureReporter:
             print(search_data["query"])
             exit(1)
         else:
-            result = [item["id"] for item in rslt.json()["workItems"]]
-
-            if len(result) > self.taskitem_query_limit:
+            # the limit is checked before duplicated ids are dropped: the response is cut at $top,
+            # so a duplicate within it may hide further TaskItems
+            if len(task_ids) > self.taskitem_query_limit:
                 print(
                     f"""
-                Too much TaskItems have been found: {len(result)}, limit {self.taskitem_query_limit}. 
+                Too much TaskItems have been found: more than the limit of {self.taskitem_query_limit}.
                 """
                 )
                 exit(1)
+
+            # duplicated ids are dropped, so that no TaskItem is updated twice
+            result = sorted(dict.fromkeys(task_ids))
             if len(result) == 0:
                 print(
                     f'No TaskItems have been found (Task field: "{query_field}", required value: "{git_path}")'
@@ -137,6 +274,30 @@ class DevAzureReporter:
 
             return result
 
+    def _read_task_ids(self, rslt: requests.Response) -> list:
+        """
+        This function extracts TaskItems ids from a WIQL response.
+        The response holds at most taskitem_query_limit + 1 items ($top). If that is at least
+        QUERY_STREAMING_MIN_ITEMS and ijson is installed, the response is parsed as a stream,
+        so that only the ids are materialized; otherwise it is parsed at once.
+        Returns a list of TaskItems ids in the order of the response.
+        """
+        if self.taskitem_query_limit + 1 >= QUERY_STREAMING_MIN_ITEMS:
+            try:
+                # imported here, since it is only needed with a large taskitem_query_limit
+                import ijson
+            except ImportError:
+                pass
+            else:
+                # the raw stream is not decompressed by requests itself
+                rslt.raw.decode_content = True
+                try:
+                    return list(ijson.items(rslt.raw, "workItems.item.id"))
+                finally:
+                    rslt.close()
+
+        return [item["id"] for item in _json_loads(rslt.content)["workItems"]]
+
     def report_batch(
         self,
         query_field: str,
@@ -144,49 +305,231 @@ class DevAzureReporter:
         field_name: str,
         value: str,
         operation: str,
+        skip_unchanged: bool = False,
     ) -> int:
         """
         This function performs an update of all the TaskItems that match the criterion:
         A field of TaskItem (query_field) must contain a name of a current repository and branch (git_path).
         Matching TaskItems are updated: a field specified in field_name parameter is being either overwritten
         with value if operation is "replace" or appended with value if operation is "add".
+        skip_unchanged works as in report (see there); with it, current values are read for "replace" as well.
         Returns 0 if all update operations were successful or 1 otherwise.
         """
 
         task_ids = self._find_tasks(query_field, git_path)
-        results = [
-            self.report(task_id, field_name, value, operation) for task_id in task_ids
-        ]
+        if not task_ids:
+            return 1
+
+        # for "add" (and for skip_unchanged), current values of all the TaskItems are read upfront
+        # instead of one request per TaskItem
+        old_values = {}
+        if operation == "add" or skip_unchanged:
+            for start in range(0, len(task_ids), WORKITEM_BATCH_LIMIT):
+                old_values.update(
+                    self._read_values(
+                        task_ids[start : start + WORKITEM_BATCH_LIMIT], field_name
+                    )
+                )
+
+        # for "replace", the payload is the same for every TaskItem, so it is serialized only once
+        payload = (
+            _json_dumps(
+                [{"op": operation, "path": f"/fields/{field_name}", "value": value}]
+            )
+            if operation == "replace"
+            else None
+        )
+
+        def update(task_id: int) -> int:
+            if payload is None:
+                return self.report(
+                    task_id,
+                    field_name,
+                    value,
+                    operation,
+                    prefetched_old_value=old_values.get(task_id),
+                    skip_unchanged=skip_unchanged,
+                )
+            if skip_unchanged and self._update_is_redundant(
+                old_values.get(task_id), value, operation
+            ):
+                print(f"Task #{task_id} already contains the value, update skipped")
+                return 0
+            return self._patch(task_id, field_name, value, payload)
+
+        # TaskItems are updated concurrently, the pool size matches the HTTP connection pool
+        with ThreadPoolExecutor(
+            max_workers=min(HTTP_POOL_MAXSIZE, len(task_ids))
+        ) as executor:
+            results = list(executor.map(update, task_ids))
 
         return 0 if set(results) == {0} else 1
 
-    def report(self, task_id: int, field_name: str, value: str, operation: str) -> int:
+    def report_batch_bulk(
+        self,
+        query_field: str,
+        git_path: str,
+        field_name: str,
+        value: str,
+        operation: str,
+        skip_unchanged: bool = False,
+    ) -> int:
+        """
+        This function does the same as report_batch, but sends all the updates in a single
+        $batch request (up to WORKITEM_BATCH_LIMIT TaskItems per request) instead of one PATCH per TaskItem.
+        If operation is "add", current field values are read with one request as well;
+        TaskItems missing from that response are updated one by one via report.
+        TaskItems that failed to update within the batch (or all TaskItems of a chunk whose $batch request failed)
+        are retried one by one via report.
+        Returns 0 if all update operations were successful or 1 otherwise.
+        """
+
+        task_ids = self._find_tasks(query_field, git_path)
+        if not task_ids:
+            return 1
+
+        results = []
+        for start in range(0, len(task_ids), WORKITEM_BATCH_LIMIT):
+            chunk = task_ids[start : start + WORKITEM_BATCH_LIMIT]
+            old_values = (
+                self._read_values(chunk, field_name)
+                if operation == "add" or skip_unchanged
+                else {}
+            )
+            # TaskItems whose current value has not been read are updated one by one via report,
+            # so that their field is not overwritten with the appended value only
+            missing = [task_id for task_id in chunk if task_id not in old_values]
+            if operation == "add" and missing:
+                results += [
+                    self.report(
+                        task_id,
+                        field_name,
+                        value,
+                        operation,
+                        skip_unchanged=skip_unchanged,
+                    )
+                    for task_id in missing
+                ]
+                chunk = [task_id for task_id in chunk if task_id in old_values]
+            skipped = [
+                task_id
+                for task_id in chunk
+                if skip_unchanged
+                and self._update_is_redundant(old_values.get(task_id), value, operation)
+            ]
+            for task_id in skipped:
+                print(f"Task #{task_id} already contains the value, update skipped")
+            chunk = [task_id for task_id in chunk if task_id not in skipped]
+            if not chunk:
+                continue
+
+            new_values = {
+                task_id: value
+                if operation != "add"
+                else f"{old_values[task_id]}{ADD_OPERATION_SEPARATOR}{value}"
+                for task_id in chunk
+            }
+            batch = [
+                {
+                    "method": "PATCH",
+                    "uri": f"/_apis/wit/workItems/{task_id}?api-version={WORKITEM_API_VERSION}",
+                    "headers": {"Content-Type": "application/json-patch+json"},
+                    "body": [
+                        {
+                            "op": operation,
+                            "path": f"/fields/{field_name}",
+                            "value": new_values[task_id],
+                        }
+                    ],
+                }
+                for task_id in chunk
+            ]
+            try:
+                rslt = self._session.post(
+                    f"{self.batch_url}{self._workitem_qs}",
+                    headers={"Content-Type": "application/json"},
+                    data=_json_dumps(batch),
+                    timeout=10,
+                )
+                rslt.raise_for_status()
+                codes = [
+                    item.get("code") for item in _json_loads(rslt.content)["value"]
+                ]
+            except ConnectTimeout as e:
+                print(f"Connection timeout for {self.batch_url}")
+                exit(1)
+            except Exception as e:
+                # the whole chunk is updated one by one via report below
+                print(e)
+                codes = []
+
+            for task_id, code in zip(chunk, codes):
+                print(f"Response HTTP status code for task #{task_id}: {code}")
+                if code is not None and code < 400:
+                    self._field_cache[(task_id, field_name)] = new_values[task_id]
+            failed = [
+                task_id
+                for task_id, code in zip(chunk, codes)
+                if code is None or code >= 400
+            ] + chunk[len(codes) :]
+            results += [
+                self.report(
+                    task_id, field_name, value, operation, skip_unchanged=skip_unchanged
+                )
+                for task_id in failed
+            ]
+
+        return 0 if set(results) <= {0} else 1
+
+    def report(
+        self,
+        task_id: int,
+        field_name: str,
+        value: str,
+        operation: str,
+        prefetched_old_value: str = None,
+        skip_unchanged: bool = False,
+    ) -> int:
         """
         This function performs update of a single TaskItem at dev.azure.com
         Parameters: task_id, field_name (where to write to), value (what to write)
         and operation (add to existing field value or replace it).
+        If prefetched_old_value is given, it is used as the current field value
+        instead of reading it from dev.azure.com.
+        If skip_unchanged is True, the current field value is read for "replace" as well, and no PATCH
+        is sent when the update would not change the field (see _update_is_redundant). It is off by default,
+        since appending the same value again (e.g. the same build status) is a legitimate update.
         Returns 0 if operation was successful or 1 otherwise.
         """
-        data = [
-            {
-                "op": operation,
-                "path": f"/fields/{field_name}",
-                "value": value
-                if operation != "add"
-                else f"{self._read_value(task_id,field_name)}<br>==========<br>{value}",
-            }
-        ]
-        url = f"{self.workitem_url}{task_id}"
+        if prefetched_old_value is None and (operation == "add" or skip_unchanged):
+            prefetched_old_value = self._read_value(task_id, field_name)
+        if skip_unchanged and self._update_is_redundant(
+            prefetched_old_value, value, operation
+        ):
+            print(f"Task #{task_id} already contains the value, update skipped")
+            return 0
+        new_value = (
+            value
+            if operation != "add"
+            else f"{prefetched_old_value}{ADD_OPERATION_SEPARATOR}{value}"
+        )
+        data = [{"op": operation, "path": f"/fields/{field_name}", "value": new_value}]
+        return self._patch(task_id, field_name, new_value, _json_dumps(data))
+
+    def _patch(
+        self, task_id: int, field_name: str, new_value: str, payload: bytes
+    ) -> int:
+        """
+        This function sends an already serialized JSON-patch payload to a single TaskItem.
+        field_name is the field the payload writes new_value to, new_value is cached on success.
+        Returns 0 if operation was successful or 1 otherwise.
+        """
+        url = f"{self.workitem_url}{task_id}{self._workitem_qs}"
         try:
-            rslt = requests.patch(
+            rslt = self._session.patch(
                 url,
-                headers={
-                    "Accept": "application/json",
-                    "Content-Type": "application/json-patch+json",
-                },
-                auth=HTTPBasicAuth("", self.token),
-                params={"api-version": WORKITEM_API_VERSION},
-                data=json.dumps(data),
+                headers={"Content-Type": "application/json-patch+json"},
+                data=payload,
                 timeout=10,
             )
             rslt.raise_for_status()
@@ -195,14 +538,21 @@ class DevAzureReporter:
             exit(1)
         except Exception as e:
             print(e)
-            print(f"payload: {json.dumps(data)}")
+            print(f"payload: {payload.decode()}")
             return 1
         else:
             print(f"Response HTTP status code for task #{task_id}: {rslt.status_code}")
+            self._field_cache[(task_id, field_name)] = new_value
             return 0
 
 
-if __name__ == "__main__":
+def _build_parser() -> "argparse.ArgumentParser":
+    """
+    This function builds the command-line parser.
+    argparse is imported here, so that importing DevAzureReporter as a library does not pay for it.
+    """
+    import argparse
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -251,6 +601,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "-task_limit",
         required=False,
+        type=int,
         default=TASKITEM_QUERY_LIMIT,
         help="""
         If specified, the parameter overrides the default limit of the number of TaskItems
@@ -289,28 +640,65 @@ if __name__ == "__main__":
         Allowed values: "replace", "add" (appends the field_value to the existing field). Default value is "replace".
     """,
     )
+    parser.add_argument(
+        "-bulk",
+        action="store_true",
+        help="""
+        If specified, TaskItems found via <git_path> and <filter_by> are updated with a single $batch request
+        (up to 200 TaskItems per request) instead of one request per TaskItem.
+        Cannot be used with <task_id> parameter.
+    """,
+    )
+    parser.add_argument(
+        "-skip_unchanged",
+        action="store_true",
+        help="""
+        If specified, TaskItems are not updated when the field already ends with <field_value> ("add")
+        or equals it ("replace"; the current value is read first). Useful when re-running the script after a failure; without it,
+        every run appends <field_value> even if the previous run appended the same value.
+    """,
+    )
 
-    args = parser.parse_args()
+    return parser
 
-    reporter = DevAzureReporter(args.project_path, args.token, args.task_limit)
 
-    # depending on parameters, either update a single TaskItem by task_id or many TaskItems that match the search criterion
-    if args.task_id and (args.filter_by == args.git_path == None):
-        result = reporter.report(
-            args.task_id, args.field_name, args.field_value, args.operation
-        )
-    elif (args.filter_by and args.git_path) and args.task_id is None:
-        result = reporter.report_batch(
-            args.filter_by,
-            args.git_path,
-            args.field_name,
-            args.field_value,
-            args.operation,
-        )
-    else:
-        print(
-            "Please either specify a single task via <task_id> or search criterion via <git_path> and <filter_by>."
-        )
-        result = 1
+def _main() -> int:
+    """
+    This function runs the command-line tool.
+    Returns 0 if all update operations were successful or 1 otherwise.
+    """
+    args = _build_parser().parse_args()
 
-    exit(result)
\ No newline at end of file
+    with DevAzureReporter(args.project_path, args.token, args.task_limit) as reporter:
+        # depending on parameters, either update a single TaskItem by task_id or many TaskItems that match the search criterion
+        if args.task_id and (args.filter_by == args.git_path == None):
+            result = reporter.report(
+                args.task_id,
+                args.field_name,
+                args.field_value,
+                args.operation,
+                skip_unchanged=args.skip_unchanged,
+            )
+        elif (args.filter_by and args.git_path) and args.task_id is None:
+            report_batch = (
+                reporter.report_batch_bulk if args.bulk else reporter.report_batch
+            )
+            result = report_batch(
+                args.filter_by,
+                args.git_path,
+                args.field_name,
+                args.field_value,
+                args.operation,
+                skip_unchanged=args.skip_unchanged,
+            )
+        else:
+            print(
+                "Please either specify a single task via <task_id> or search criterion via <git_path> and <filter_by>."
+            )
+            result = 1
+
+    return result
+
+
+if __name__ == "__main__":
+    sys.exit(_main())
@@ -0,0 +1,108 @@
+import io
+import json
+from urllib.parse import parse_qs, urlsplit
+
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from urllib3.exceptions import ProtocolError
+
+
+class BrokenBody:
+    """
+    Response body whose connection drops while it is being downloaded.
+    """
+
+    def stream(self, *args, **kwargs):
+        raise ProtocolError("Connection broken")
+
+    def read(self, *args, **kwargs):
+        raise ProtocolError("Connection broken")
+
+    def close(self):
+        pass
+
+
+class FakeAzureAdapter(BaseAdapter):
+    """
+    Transport adapter that answers dev.azure.com requests from in-memory TaskItems
+    and records every request sent through it.
+    """
+
+    def __init__(
+        self,
+        fields,
+        wiql_ids,
+        batch_codes=None,
+        read_omitted_ids=(),
+        broken_wiql_body=False,
+        batch_response=None,
+    ):
+        super().__init__()
+        self.broken_wiql_body = broken_wiql_body
+        # (status code, body) returned for every $batch request instead of batch_codes
+        self.batch_response = batch_response
+        self.fields = fields
+        self.wiql_ids = wiql_ids
+        self.batch_codes = batch_codes or {}
+        self.read_omitted_ids = read_omitted_ids
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        path = request.url.split("?")[0]
+        if path.endswith("/wiql"):
+            top = parse_qs(urlsplit(request.url).query).get("$top")
+            wiql_ids = self.wiql_ids[: int(top[0])] if top else self.wiql_ids
+            body = {"workItems": [{"id": task_id} for task_id in wiql_ids]}
+        elif path.endswith("/workitemsbatch"):
+            ids = json.loads(request.body)["ids"]
+            body = {
+                "value": [
+                    {"id": task_id, "fields": self.fields.get(task_id, {})}
+                    for task_id in ids
+                    if task_id not in self.read_omitted_ids
+                ]
+            }
+        elif path.endswith("/$batch"):
+            operations = json.loads(request.body)
+            body = {
+                "value": [
+                    {"code": self.batch_codes.get(self._task_id(operation["uri"]), 200)}
+                    for operation in operations
+                ]
+            }
+        elif request.method == "GET":
+            body = {"fields": self.fields.get(self._task_id(path), {})}
+        else:
+            body = {}
+
+        status_code = 200
+        if self.batch_response is not None and path.endswith("/$batch"):
+            status_code, body = self.batch_response
+
+        response = Response()
+        response.status_code = status_code
+        response.url = request.url
+        response.request = request
+        if self.broken_wiql_body and path.endswith("/wiql"):
+            response.raw = BrokenBody()
+            return response
+        content = json.dumps(body).encode()
+        response.raw = io.BytesIO(content)
+        response.headers["Content-Length"] = str(len(content))
+        return response
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def _task_id(uri):
+        return int(uri.split("?")[0].rsplit("/", 1)[1])
+
+    def sent(self, method, path_suffix):
+        return [
+            request
+            for request in self.requests
+            if request.method == method
+            and request.url.split("?")[0].endswith(path_suffix)
+        ]
@@ -0,0 +1,68 @@
+import importlib.util
+import io
+import unittest
+from contextlib import redirect_stdout
+from unittest import mock
+
+from dev_azure_reporter.__main__ import DevAzureReporter
+from tests.fake_azure import FakeAzureAdapter
+
+
+class FindTasksTest(unittest.TestCase):
+    def find_tasks(self, wiql_ids, taskitem_query_limit, **adapter_kwargs):
+        reporter = DevAzureReporter("org/project", "token", taskitem_query_limit)
+        reporter._session.mount(
+            "https://",
+            FakeAzureAdapter(fields={}, wiql_ids=wiql_ids, **adapter_kwargs),
+        )
+        self.addCleanup(reporter.close)
+        return reporter._find_tasks("System.Description", "my_repo/this_branch")
+
+    def test_duplicated_ids_are_dropped_and_sorted(self):
+        self.assertEqual(self.find_tasks([3, 1, 3], taskitem_query_limit=5), [1, 3])
+
+    def test_duplicates_do_not_bypass_the_limit(self):
+        # with $top=2 the server returns [5, 5], hiding TaskItem 9
+        with self.assertRaises(SystemExit):
+            self.find_tasks([5, 5, 9], taskitem_query_limit=1)
+
+    def test_connection_drop_while_reading_the_body_is_handled(self):
+        with self.assertRaises(SystemExit), redirect_stdout(io.StringIO()) as output:
+            self.find_tasks([1], taskitem_query_limit=5, broken_wiql_body=True)
+
+        self.assertIn("Connection broken", output.getvalue())
+
+    def test_limit_changed_after_init_is_used_for_top(self):
+        reporter = DevAzureReporter("org/project", "token", taskitem_query_limit=1)
+        reporter._session.mount(
+            "https://", FakeAzureAdapter(fields={}, wiql_ids=[1, 2, 3, 4, 5])
+        )
+        self.addCleanup(reporter.close)
+        reporter.taskitem_query_limit = 10
+
+        self.assertEqual(
+            reporter._find_tasks("System.Description", "my_repo/this_branch"),
+            [1, 2, 3, 4, 5],
+        )
+
+    @unittest.skipUnless(importlib.util.find_spec("ijson"), "ijson is not installed")
+    def test_ids_are_streamed_with_a_large_limit(self):
+        with mock.patch(
+            "requests.Response.content", new_callable=mock.PropertyMock
+        ) as content:
+            result = self.find_tasks([3, 1, 2], taskitem_query_limit=2000)
+
+        self.assertEqual(result, [1, 2, 3])
+        content.assert_not_called()
+
+    @unittest.skipUnless(importlib.util.find_spec("ijson"), "ijson is not installed")
+    def test_ids_are_parsed_at_once_with_a_small_limit(self):
+        with mock.patch("ijson.items") as items:
+            result = self.find_tasks([3, 1, 2], taskitem_query_limit=5)
+
+        self.assertEqual(result, [1, 2, 3])
+        items.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
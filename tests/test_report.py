@@ -0,0 +1,71 @@
+import json
+import unittest
+
+from dev_azure_reporter.__main__ import DevAzureReporter
+from tests.fake_azure import FakeAzureAdapter
+
+
+class ReportTest(unittest.TestCase):
+    def make_reporter(self, **adapter_kwargs):
+        reporter = DevAzureReporter("org/project", "token")
+        adapter = FakeAzureAdapter(wiql_ids=[], **adapter_kwargs)
+        reporter._session.mount("https://", adapter)
+        self.addCleanup(reporter.close)
+        return reporter, adapter
+
+    def test_repeated_add_reuses_written_value(self):
+        reporter, adapter = self.make_reporter(fields={7: {"Custom.Notes": "a"}})
+
+        self.assertEqual(reporter.report(7, "Custom.Notes", "v1", "add"), 0)
+        self.assertEqual(reporter.report(7, "Custom.Notes", "v2", "add"), 0)
+
+        self.assertEqual(
+            [request.method for request in adapter.requests], ["GET", "PATCH", "PATCH"]
+        )
+        self.assertEqual(
+            json.loads(adapter.requests[-1].body)[0]["value"],
+            "a<br>==========<br>v1<br>==========<br>v2",
+        )
+
+    def test_add_of_the_last_value_is_sent_by_default(self):
+        reporter, adapter = self.make_reporter(
+            fields={7: {"Custom.Notes": "a<br>==========<br>v"}}
+        )
+
+        self.assertEqual(reporter.report(7, "Custom.Notes", "v", "add"), 0)
+
+        self.assertEqual(
+            json.loads(adapter.requests[-1].body)[0]["value"],
+            "a<br>==========<br>v<br>==========<br>v",
+        )
+
+    def test_add_of_the_last_value_is_skipped_with_skip_unchanged(self):
+        reporter, adapter = self.make_reporter(
+            fields={7: {"Custom.Notes": "a<br>==========<br>v"}}
+        )
+
+        self.assertEqual(
+            reporter.report(7, "Custom.Notes", "v", "add", skip_unchanged=True), 0
+        )
+
+        self.assertEqual([request.method for request in adapter.requests], ["GET"])
+
+    def test_replace_with_the_current_value_is_skipped_with_skip_unchanged(self):
+        reporter, adapter = self.make_reporter(fields={7: {"Custom.Notes": "v"}})
+
+        self.assertEqual(
+            reporter.report(7, "Custom.Notes", "v", "replace", skip_unchanged=True), 0
+        )
+
+        self.assertEqual([request.method for request in adapter.requests], ["GET"])
+
+    def test_replace_does_not_read_the_value_by_default(self):
+        reporter, adapter = self.make_reporter(fields={7: {"Custom.Notes": "v"}})
+
+        self.assertEqual(reporter.report(7, "Custom.Notes", "v", "replace"), 0)
+
+        self.assertEqual([request.method for request in adapter.requests], ["PATCH"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import json
+import unittest
+from unittest import mock
+
+from dev_azure_reporter.__main__ import DevAzureReporter
+from tests.fake_azure import FakeAzureAdapter
+
+
+class ReportBatchTest(unittest.TestCase):
+    def make_reporter(self, **adapter_kwargs):
+        reporter = DevAzureReporter("org/project", "token", taskitem_query_limit=10)
+        adapter = FakeAzureAdapter(**adapter_kwargs)
+        reporter._session.mount("https://", adapter)
+        self.addCleanup(reporter.close)
+        return reporter, adapter
+
+    def batch(self, reporter, operation):
+        return reporter.report_batch(
+            "System.Description", "my_repo/this_branch", "Custom.Notes", "v", operation
+        )
+
+    def patched_values(self, adapter):
+        return {
+            FakeAzureAdapter._task_id(patch.url): json.loads(patch.body)[0]["value"]
+            for patch in adapter.sent("PATCH", "")
+        }
+
+    def test_add_prefetches_current_values_with_one_request(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}, 2: {}}, wiql_ids=[1, 2]
+        )
+
+        self.assertEqual(self.batch(reporter, "add"), 0)
+
+        (prefetch,) = adapter.sent("POST", "/workitemsbatch")
+        self.assertEqual(
+            json.loads(prefetch.body), {"ids": [1, 2], "fields": ["Custom.Notes"]}
+        )
+        self.assertEqual(adapter.sent("GET", ""), [])
+        self.assertEqual(
+            self.patched_values(adapter),
+            {1: "a<br>==========<br>v", 2: "<br>==========<br>v"},
+        )
+
+    def test_add_prefetch_is_chunked_by_batch_limit(self):
+        reporter, adapter = self.make_reporter(
+            fields={task_id: {"Custom.Notes": str(task_id)} for task_id in (1, 2, 3)},
+            wiql_ids=[1, 2, 3],
+        )
+
+        with mock.patch("dev_azure_reporter.__main__.WORKITEM_BATCH_LIMIT", 2):
+            self.assertEqual(self.batch(reporter, "add"), 0)
+
+        self.assertEqual(
+            [
+                json.loads(prefetch.body)["ids"]
+                for prefetch in adapter.sent("POST", "/workitemsbatch")
+            ],
+            [[1, 2], [3]],
+        )
+        self.assertEqual(len(adapter.sent("PATCH", "")), 3)
+
+    def test_add_reads_value_of_task_missing_from_prefetch(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}, 2: {"Custom.Notes": "b"}},
+            wiql_ids=[1, 2],
+            read_omitted_ids=(2,),
+        )
+
+        self.assertEqual(self.batch(reporter, "add"), 0)
+
+        (get,) = adapter.sent("GET", "")
+        self.assertEqual(FakeAzureAdapter._task_id(get.url), 2)
+        self.assertEqual(
+            self.patched_values(adapter),
+            {1: "a<br>==========<br>v", 2: "b<br>==========<br>v"},
+        )
+
+    def test_replace_sends_the_same_payload_without_reading_values(self):
+        reporter, adapter = self.make_reporter(fields={}, wiql_ids=[1, 2, 3])
+
+        self.assertEqual(self.batch(reporter, "replace"), 0)
+
+        patches = adapter.sent("PATCH", "")
+        self.assertEqual(len(patches), 3)
+        self.assertEqual(len({patch.body for patch in patches}), 1)
+        self.assertEqual(
+            json.loads(patches[0].body),
+            [{"op": "replace", "path": "/fields/Custom.Notes", "value": "v"}],
+        )
+        self.assertEqual(adapter.sent("GET", ""), [])
+        self.assertEqual(adapter.sent("POST", "/workitemsbatch"), [])
+
+    def test_replace_skips_unchanged_tasks_with_skip_unchanged(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "v"}, 2: {"Custom.Notes": "old"}},
+            wiql_ids=[1, 2],
+        )
+
+        self.assertEqual(
+            reporter.report_batch(
+                "System.Description",
+                "my_repo/this_branch",
+                "Custom.Notes",
+                "v",
+                "replace",
+                skip_unchanged=True,
+            ),
+            0,
+        )
+
+        self.assertEqual(len(adapter.sent("POST", "/workitemsbatch")), 1)
+        self.assertEqual(self.patched_values(adapter), {2: "v"})
+
+
+if __name__ == "__main__":
+    unittest.main()
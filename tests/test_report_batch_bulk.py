@@ -0,0 +1,119 @@
+import json
+import unittest
+from unittest import mock
+
+from dev_azure_reporter.__main__ import DevAzureReporter
+from tests.fake_azure import FakeAzureAdapter
+
+
+class ReportBatchBulkTest(unittest.TestCase):
+    def make_reporter(self, **adapter_kwargs):
+        reporter = DevAzureReporter("org/project", "token", taskitem_query_limit=10)
+        adapter = FakeAzureAdapter(**adapter_kwargs)
+        reporter._session.mount("https://", adapter)
+        self.addCleanup(reporter.close)
+        return reporter, adapter
+
+    def bulk_add(self, reporter):
+        return reporter.report_batch_bulk(
+            "System.Description", "my_repo/this_branch", "Custom.Notes", "v", "add"
+        )
+
+    def test_add_appends_to_current_values_in_one_batch(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}, 2: {"Custom.Notes": "b"}},
+            wiql_ids=[1, 2],
+        )
+
+        self.assertEqual(self.bulk_add(reporter), 0)
+
+        (batch,) = adapter.sent("POST", "/$batch")
+        values = [operation["body"][0]["value"] for operation in json.loads(batch.body)]
+        self.assertEqual(values, ["a<br>==========<br>v", "b<br>==========<br>v"])
+        self.assertEqual(adapter.sent("PATCH", ""), [])
+
+    def test_add_falls_back_to_report_for_task_missing_from_read_values(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}, 2: {"Custom.Notes": "b"}},
+            wiql_ids=[1, 2],
+            read_omitted_ids=(2,),
+        )
+
+        self.assertEqual(self.bulk_add(reporter), 0)
+
+        (batch,) = adapter.sent("POST", "/$batch")
+        self.assertEqual(
+            [operation["uri"].split("?")[0] for operation in json.loads(batch.body)],
+            ["/_apis/wit/workItems/1"],
+        )
+        (patch,) = adapter.sent("PATCH", "/workItems/2")
+        self.assertEqual(json.loads(patch.body)[0]["value"], "b<br>==========<br>v")
+
+    def test_failed_batch_entries_are_retried_one_by_one(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}, 2: {"Custom.Notes": "b"}},
+            wiql_ids=[1, 2],
+            batch_codes={2: 409},
+        )
+
+        self.assertEqual(self.bulk_add(reporter), 0)
+
+        self.assertEqual(adapter.sent("PATCH", "/workItems/1"), [])
+        (patch,) = adapter.sent("PATCH", "/workItems/2")
+        self.assertEqual(json.loads(patch.body)[0]["value"], "b<br>==========<br>v")
+
+    def test_failed_batch_request_falls_back_to_report_for_every_chunk(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}, 2: {"Custom.Notes": "b"}},
+            wiql_ids=[1, 2],
+            batch_response=(400, {}),
+        )
+
+        with mock.patch("dev_azure_reporter.__main__.WORKITEM_BATCH_LIMIT", 1):
+            self.assertEqual(self.bulk_add(reporter), 0)
+
+        self.assertEqual(len(adapter.sent("POST", "/$batch")), 2)
+        self.assertEqual(
+            [json.loads(patch.body)[0]["value"] for patch in adapter.sent("PATCH", "")],
+            ["a<br>==========<br>v", "b<br>==========<br>v"],
+        )
+
+    def test_unexpected_batch_response_falls_back_to_report(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "a"}},
+            wiql_ids=[1],
+            batch_response=(200, {"unexpected": True}),
+        )
+
+        self.assertEqual(self.bulk_add(reporter), 0)
+
+        (patch,) = adapter.sent("PATCH", "/workItems/1")
+        self.assertEqual(json.loads(patch.body)[0]["value"], "a<br>==========<br>v")
+
+    def test_replace_skips_unchanged_tasks_with_skip_unchanged(self):
+        reporter, adapter = self.make_reporter(
+            fields={1: {"Custom.Notes": "v"}, 2: {"Custom.Notes": "old"}},
+            wiql_ids=[1, 2],
+        )
+
+        self.assertEqual(
+            reporter.report_batch_bulk(
+                "System.Description",
+                "my_repo/this_branch",
+                "Custom.Notes",
+                "v",
+                "replace",
+                skip_unchanged=True,
+            ),
+            0,
+        )
+
+        (batch,) = adapter.sent("POST", "/$batch")
+        self.assertEqual(
+            [operation["uri"].split("?")[0] for operation in json.loads(batch.body)],
+            ["/_apis/wit/workItems/2"],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()